@@ -14,36 +14,125 @@
 # - Implement tagging to filter installed things
 
 import argparse
-import distro
-import glob
-import io
+import atexit
+import collections
+import errno
+import functools
+import mmap
 import os
-import yaml
+import re
+import stat
+import sys
+import tempfile
 
+# The yaml, distro, pickle and concurrent.futures modules are only imported
+# when they are first used, to keep the startup time of simple commands down
 
-# Hack to support using this on python versions too old to include the
-# glob.glob() include_hidden=True option
-def _ishidden(pattern):
-    return False
 
+def _yaml_load(stream):
+    """Parse YAML, with the libyaml based loader if it is available"""
+    import yaml
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    return yaml.load(stream, Loader=loader)
 
-glob._ishidden = _ishidden
 
+def _yaml_dump(data, stream=None, **kwargs):
+    """Emit YAML, with the libyaml based dumper if it is available"""
+    import yaml
+    dumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+    return yaml.dump(data, stream=stream, Dumper=dumper, **kwargs)
 
+
+# Uses $HOME when it is set, only falling back to the passwd entry
+_home = os.path.expanduser("~")
+
+
+def _expanduser(path):
+    """Expand a leading ~ using the home dir found at startup"""
+    if path == "~":
+        return _home
+    if path.startswith("~/"):
+        return _home.rstrip("/") + path[1:]
+    # Other users' home dirs still need a lookup
+    return os.path.expanduser(path)
+
+
+def _as_list(value):
+    """Metadata values can be a single item or a list, always return a list"""
+    if isinstance(value, list):
+        return value
+    return [value]
+
+
+# The list of registered source locations, in our config_home
+_sources_conf = "sources.yml"
+
+
+@functools.lru_cache(maxsize=1)
 def _config_home():
     """Calculate our config_home"""
     xdg_config_home = os.environ.get("XDG_CONFIG_HOME")
     if not xdg_config_home:
-        xdg_config_home = os.path.expanduser("~/.config")
+        xdg_config_home = os.path.join(_home, ".config")
     return os.path.join(xdg_config_home, "dots")
 
 
+@functools.lru_cache(maxsize=1)
+def _cache_home():
+    """Calculate our cache_home"""
+    xdg_cache_home = os.environ.get("XDG_CACHE_HOME")
+    if not xdg_cache_home:
+        xdg_cache_home = os.path.join(_home, ".cache")
+    return os.path.join(xdg_cache_home, "dots")
+
+
+@functools.lru_cache(maxsize=1)
+def _distro_id():
+    """Find out which distro we are running on"""
+    import distro
+    return distro.id()
+
+
+def _atomic_write(filename, data):
+    """Replace filename with the given bytes, never leaving a partial file"""
+    # Write through any symlink (eg: a config kept in a dots repo) instead
+    # of replacing the link itself
+    filename = os.path.realpath(filename)
+
+    try:
+        mode = stat.S_IMODE(os.stat(filename).st_mode)
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        mode = 0o666 & ~umask
+
+    fd, tmpname = tempfile.mkstemp(
+        dir=os.path.dirname(filename),
+        prefix=f".{os.path.basename(filename)}.",
+    )
+    try:
+        try:
+            os.fchmod(fd, mode)
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+            # Make sure the data is on disk before the rename makes it
+            # visible, or a crash could still leave an empty file
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.replace(tmpname, filename)
+    except BaseException:
+        os.unlink(tmpname)
+        raise
+
+
 def _config_load(name):
     """Load a config file from our config_home, or return an empty dict"""
     confdir = _config_home()
     try:
         f = open(os.path.join(confdir, name))
-        return yaml.safe_load(f)
+        return _yaml_load(f)
     except FileNotFoundError:
         return {}
 
@@ -52,57 +141,206 @@ def _config_save(name, config):
     """Save the config file to our config_home"""
     confdir = _config_home()
     os.makedirs(confdir, exist_ok=True)
-    f = open(os.path.join(confdir, name), "w")
-    print("# Automatically written file, edit with care", file=f)
-    yaml.safe_dump(
+    data = "# Automatically written file, edit with care\n" + _yaml_dump(
         config,
-        stream=f,
         explicit_start=True,
         explicit_end=True,
         default_flow_style=False,
     )
+    _atomic_write(os.path.join(confdir, name), data.encode("utf-8"))
+
+
+@functools.lru_cache()
+def _metadata_res(indent):
+    """Compile the patterns to find the end of and unindent a metadata block"""
+    end_re = re.compile(rb"^.{%d}\.\.\.[ \t\r]*(\n|\Z)" % indent, re.M)
+    # Removes the indent from the start, and any whitespace from the end,
+    # of every line
+    unindent_re = re.compile(rb"^.{0,%d}|[ \t\r]+$" % indent, re.M)
+    return end_re, unindent_re
 
 
 def _source_load(filename):
     """Open a file and look for dotsctl metadata"""
     check_lines = 30  # basically one page
+    check_bytes = 8192
+    map_bytes = 65536
 
-    fh = open(filename)
-    line_nr = 0
-    indent = None
+    # Only the raw fd is needed for the mmap, not a buffered file object
+    fd = os.open(filename, os.O_RDONLY)
+    try:
+        size = os.fstat(fd).st_size
+        if size == 0:
+            return None
+
+        # Search the start of the file in place, without copying it
+        with mmap.mmap(
+            fd,
+            min(size, map_bytes),
+            access=mmap.ACCESS_READ,
+        ) as mm:
+            # Look for a metadata header line
+            idx = mm.find(b":dotsctl:", 0, check_bytes)
+            if idx < 0:
+                # never found a header
+                return None
+            if mm[:idx].count(b"\n") >= check_lines:
+                # the header is too far into the file
+                return None
+            if mm.find(b"\0", 0, idx) >= 0:
+                # Its not text..
+                return None
+
+            # Record the indent level of the header
+            indent = idx - (mm.rfind(b"\n", 0, idx) + 1)
+
+            # The metadata ends with a correctly indented "..." line
+            end_re, unindent_re = _metadata_res(indent)
+            end = end_re.search(mm, idx)
+            if not end:
+                # never found the end of the metadata
+                return None
+
+            block = mm[mm.find(b"\n", idx) + 1:end.end()]
+    finally:
+        os.close(fd)
+
+    # The yaml parser takes the bytes as they are, no need to decode them
+    metadata = _yaml_load(unindent_re.sub(b"", block))
+    return metadata
 
-    # Look for a metadata header line
-    # (and record its indent level)
-    while line_nr < check_lines:
-        line_nr += 1
 
-        try:
-            line = fh.readline()
-        except UnicodeDecodeError:
-            # Its not text..
-            return
+# Parsed metadata, keyed by absolute filename, so that unchanged files do
+# not need to be read again on the next run
+_meta_cache = None
+_meta_cache_dirty = False
+_meta_cache_seen = set()
+_meta_cache_prune = False
+_meta_cache_name = "meta.pickle"
+_meta_cache_version = 2
+_meta_max_size = 1000000
+
+
+def _meta_cache_load():
+    """Load the metadata cache from our cache_home, or start an empty one"""
+    global _meta_cache
+    _meta_cache = {}
+    atexit.register(_meta_cache_save)
+
+    import pickle
+
+    try:
+        with open(os.path.join(_cache_home(), _meta_cache_name), "rb") as f:
+            version, cache = pickle.load(f)
+    except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+        # A missing or broken cache is just an empty one
+        return
+
+    if version == _meta_cache_version:
+        _meta_cache = cache
 
-        try:
-            indent = line.index(":dotsctl:")
-            break
-        except ValueError:
-            continue
 
-    if indent is None:
-        # never found a header
+def _meta_cache_save():
+    """Save the metadata cache to our cache_home, if it was changed"""
+    global _meta_cache_dirty
+
+    # After a walk of all the configured sources, anything not seen has
+    # been deleted (or is no longer a source), so forget it
+    if _meta_cache_prune:
+        for key in list(_meta_cache):
+            if key not in _meta_cache_seen:
+                del _meta_cache[key]
+                _meta_cache_dirty = True
+
+    if not _meta_cache_dirty:
+        return
+
+    import pickle
+    cachedir = _cache_home()
+    try:
+        os.makedirs(cachedir, exist_ok=True)
+        _atomic_write(
+            os.path.join(cachedir, _meta_cache_name),
+            pickle.dumps(
+                (_meta_cache_version, _meta_cache),
+                protocol=pickle.HIGHEST_PROTOCOL,
+            ),
+        )
+    except OSError:
+        # The cache is only an optimisation, so just skip saving it
+        pass
+
+
+def _source_load_cached(filename):
+    """Look for dotsctl metadata, only reading the file if it has changed"""
+    global _meta_cache_dirty
+    if _meta_cache is None:
+        _meta_cache_load()
+
+    st = os.stat(filename)
+    if st.st_size > _meta_max_size:
+        # The header must be near the start, so this is not a text file
+        # with metadata, it is something like an image or a binary
         return None
 
-    lines = []
-    while True:
-        line = fh.readline()[indent:].rstrip()
-        lines.append(line)
-        if line == "...":
-            break
+    key = os.path.abspath(filename)
+    stamp = (st.st_mtime_ns, st.st_size)
+    _meta_cache_seen.add(key)
+
+    cached = _meta_cache.get(key)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
 
-    metadata = yaml.safe_load(io.StringIO("\n".join(lines)))
+    metadata = _source_load(filename)
+    _meta_cache[key] = (stamp, metadata)
+    _meta_cache_dirty = True
     return metadata
 
 
+# Shared metadata blocks, loaded from the lib dir in our config_home
+_lib_cache = {}
+
+
+def _lib_load(name):
+    """Load a named shared metadata block"""
+    if name not in _lib_cache:
+        libname = os.path.join("lib", f"{name}.yml")
+        try:
+            with open(os.path.join(_config_home(), libname)) as f:
+                lib = _yaml_load(f)
+        except FileNotFoundError:
+            raise ValueError(f"Shared metadata {libname} not found") from None
+
+        if lib is None:
+            # An empty file
+            lib = {}
+        if not isinstance(lib, dict):
+            raise ValueError(f"Shared metadata {libname} is not a mapping")
+        _lib_cache[name] = lib
+    return _lib_cache[name]
+
+
+def _metadata_merge(base, metadata):
+    """Recursively merge two metadata dicts, with metadata taking priority"""
+    result = dict(base)
+    for key, value in metadata.items():
+        if isinstance(value, dict) and isinstance(result.get(key), dict):
+            value = _metadata_merge(result[key], value)
+        result[key] = value
+    return result
+
+
+def _metadata_use(metadata):
+    """Merge in any shared metadata blocks named by the _use key"""
+    if not isinstance(metadata, dict) or "_use" not in metadata:
+        return metadata
+
+    result = {k: v for k, v in metadata.items() if k != "_use"}
+    for name in _as_list(metadata["_use"]):
+        result = _metadata_merge(_lib_load(name), result)
+    return result
+
+
 class ActionBase:
     def __str__(self):
         raise NotImplementedError()
@@ -143,29 +381,44 @@ def log(action, filename):
         print(f"{action} {filename}")
 
 
+# Directories and symlinks already checked during this run, so that
+# shared destinations (eg: ~/bin) are only looked at once
+installed_dirs = set()
+installed_symlinks = {}
+
+
 def install_mkdir(mkdir):
     """Create one or more directories"""
     actions = []
 
-    if isinstance(mkdir, list):
-        for i in mkdir:
-            actions += install_mkdir(i)
-        return actions
+    stack = [mkdir]
+    while stack:
+        mkdir = stack.pop()
 
-    if not isinstance(mkdir, str):
-        raise NotImplementedError("Bad mkdirs metadata")
+        if isinstance(mkdir, list):
+            stack.extend(reversed(mkdir))
+            continue
 
-    path = os.path.expanduser(mkdir)
-    actions += [ActionMkdir(path)]
+        if not isinstance(mkdir, str):
+            raise NotImplementedError("Bad mkdirs metadata")
 
-    # Skip printing the log message if the path exists
-    if os.path.isdir(path):
-        return actions
-    if os.path.exists(path):
-        raise ValueError(f"Path exists and is not a dir: {path}")
+        path = _expanduser(mkdir)
+        actions += [ActionMkdir(path)]
+
+        if path in installed_dirs:
+            continue
+
+        # Skip printing the log message if the path exists
+        if os.path.isdir(path):
+            installed_dirs.add(path)
+            continue
+        if os.path.exists(path):
+            raise ValueError(f"Path exists and is not a dir: {path}")
+
+        log("MKDIR", path)
+        os.makedirs(path, exist_ok=True)
+        installed_dirs.add(path)
 
-    log("MKDIR", path)
-    os.makedirs(path, exist_ok=True)
     return actions
 
 
@@ -176,30 +429,41 @@ def install_symlink_one(target, linkpath):
     actions += install_mkdir(destdir)
     actions += [ActionSymlink(target, linkpath)]
 
+    if installed_symlinks.get(linkpath) == target:
+        return actions
+
+    # Most of the time, the link already exists and is correct, so just
+    # ask for its target
     try:
-        stat = os.lstat(linkpath)
+        orig_target = os.readlink(linkpath)
     except FileNotFoundError:
-        stat = None
+        orig_target = None
+    except OSError as e:
+        if e.errno != errno.EINVAL:
+            raise
+        # It exists, but is not a symlink
+        orig_target = False
 
     # TOCTOU race condition!
 
-    if stat:
-        if os.path.stat.S_ISREG(stat.st_mode):
+    if orig_target is False:
+        if stat.S_ISREG(os.lstat(linkpath).st_mode):
             print(f"Error: will not overwrite regular file {linkpath}")
             return actions
-        if os.path.stat.S_ISLNK(stat.st_mode):
-            orig_target = os.readlink(linkpath)
-            if orig_target == target:
-                # dont report making changes if there are none
-                return actions
-        else:
-            # Dont know how to handle the type we are trying to overwrite
-            raise NotImplementedError("Unknown existing file type")
+        # Dont know how to handle the type we are trying to overwrite
+        raise NotImplementedError("Unknown existing file type")
+
+    if orig_target is not None:
+        if orig_target == target:
+            # dont report making changes if there are none
+            installed_symlinks[linkpath] = target
+            return actions
 
         os.unlink(linkpath)
 
     log("SYMLINK", linkpath)
     os.symlink(target, linkpath)
+    installed_symlinks[linkpath] = target
     return actions
 
 
@@ -207,7 +471,7 @@ def install_symlink(data):
     """Create one or more symlinks from a dict of dest: target pairs"""
     actions = []
     for linkpath, target in data.items():
-        linkpath = os.path.expanduser(linkpath)
+        linkpath = _expanduser(linkpath)
         actions += install_symlink_one(target, linkpath)
     return actions
 
@@ -227,20 +491,18 @@ def install_one(args, filename, metadata):
         # Install a generic symlink, unrelated to the current filename
         actions += install_symlink(metadata["symlink"])
 
+    dests = []
     if "destdir" in metadata:
         # The destination is calculated from a dir name
-        if isinstance(metadata["destdir"], str):
-            metadata["destdir"] = [metadata["destdir"]]
-
-        dest = []
-        for destdir in metadata["destdir"]:
-            dest.append(
+        for destdir in _as_list(metadata["destdir"]):
+            dests.append(
                 os.path.join(
                     destdir,
                     os.path.basename(filename)
                 )
             )
-        metadata["dest"] = dest
+    elif "dest" in metadata:
+        dests = _as_list(metadata["dest"])
 
     if "dotsctl" in metadata:
         basedir = os.path.dirname(filename)
@@ -248,74 +510,126 @@ def install_one(args, filename, metadata):
             actions += install_one(
                 args,
                 os.path.join(basedir, this_name),
-                this_meta
+                _metadata_use(this_meta)
             )
 
-    if "dest" in metadata:
-        if isinstance(metadata["dest"], str):
-            metadata["dest"] = [metadata["dest"]]
+    for dest in dests:
+        dest = _expanduser(dest)
+        root, ext = os.path.splitext(dest)
 
-        for dest in metadata["dest"]:
-            dest = os.path.expanduser(dest)
-            root, ext = os.path.splitext(dest)
+        # TODO:
+        # if find libraries is not disabled in metadata
+        # and if ext is .py
+        # introspect filename for non-packaged libs and install them too
 
-            # TODO:
-            # if find libraries is not disabled in metadata
-            # and if ext is .py
-            # introspect filename for non-packaged libs and install them too
+        strip_extension = False
+        if ext in [".py"]:
+            strip_extension = True
 
-            strip_extension = False
-            if ext in [".py"]:
-                strip_extension = True
+        strip_extension = metadata.get("strip_extension", strip_extension)
+        if strip_extension:
+            dest = root
 
-            strip_extension = metadata.get("strip_extension", strip_extension)
-            if strip_extension:
-                dest = root
+        destdir = os.path.dirname(dest)
+        src_abs = os.path.abspath(filename)
+        src_rel = os.path.relpath(src_abs, destdir)
 
-            destdir = os.path.dirname(dest)
-            src_abs = os.path.abspath(filename)
-            src_rel = os.path.relpath(src_abs, destdir)
+        # TODO:
+        # copy to dest:  install_copy()
+        # copy to archive:  install_toarchivedir()
 
-            # TODO:
-            # copy to dest:  install_copy()
-            # copy to archive:  install_toarchivedir()
-
-            actions += install_symlink_one(src_rel, dest)
+        actions += install_symlink_one(src_rel, dest)
 
     return actions
 
 
-def sources_foreach(args, func):
-    conffile = "sources.yml"  # FIXME dry
+# Directories and file types that can never contain source files, so
+# there is no point in looking inside them
+_skip_dirs = {".git", "node_modules", "__pycache__", ".venv"}
+_skip_suffixes = (".png", ".jpg", ".o", ".pyc", ".so", ".zip")
 
-    data = {}
 
-    def source_append(filename):
-        """Trys to add dots data from filename"""
-        if filename in data:
-            raise ValueError(f"Multiple sources load same ({source})")
-        metadata = _source_load(filename)
-        if metadata is None:
-            return
-        data[filename] = metadata
+def _iter_files(root):
+    """Yield the pathname of every candidate source file below root"""
+    dirs = [root]
+    while dirs:
+        try:
+            with os.scandir(dirs.pop()) as it:
+                for entry in it:
+                    if entry.is_symlink():
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name not in _skip_dirs:
+                            dirs.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        if not entry.name.endswith(_skip_suffixes):
+                            yield entry.path
+        except OSError:
+            # Missing (eg: a stale source), not a dir, or unreadable
+            pass
+
 
-    sources = {}
+def sources_foreach(args, func):
+    global _meta_cache_prune
     if args.pathname:
-        for n in args.pathname:
-            sources[n] = True
+        sources = args.pathname
     else:
-        sources = _config_load(conffile)
-
+        sources = _config_load(_sources_conf) or {}
+        # Every source file will be seen, so stale cache entries can go
+        _meta_cache_prune = True
+
+    # Sources can overlap (eg: both ~/dots and ~/dots/vim), so only keep
+    # the outermost ones.  Their resolved paths are only used to find the
+    # overlaps, the paths as given are still what gets walked and reported.
+    # Sorting with a trailing separator puts every path directly after any
+    # of its parent directories
+    resolved = {}
     for source in sources:
+        resolved.setdefault(
+            os.path.realpath(source),
+            os.path.abspath(source),
+        )
+
+    roots = []
+    outer = None
+    for real in sorted(
+        resolved,
+        key=lambda path: path.rstrip(os.sep) + os.sep,
+    ):
+        if outer and real.startswith(outer.rstrip(os.sep) + os.sep):
+            continue
+        outer = real
+        roots.append(resolved[real])
+
+    files = []
+    for source in roots:
         if os.path.isfile(source):
-            source_append(source)
+            files.append(source)
             continue
 
-        # With newer python, include_hidden=True
-        files = glob.glob(f"{source}/**", recursive=True)
-        for file in files:
-            if os.path.isfile(file):
-                source_append(file)
+        files.extend(_iter_files(source))
+
+    # Load the cache before starting any threads that use it
+    if _meta_cache is None:
+        _meta_cache_load()
+
+    # Each file is read independently, so overlap their I/O, but do not
+    # bother starting threads when there is only one file to look at
+    workers = min(32, (os.cpu_count() or 1) * 4, len(files))
+    if workers > 1:
+        import concurrent.futures
+        with concurrent.futures.ThreadPoolExecutor(workers) as ex:
+            metadatas = list(ex.map(_source_load_cached, files))
+    else:
+        metadatas = [_source_load_cached(file) for file in files]
+
+    data = {}
+    for filename, metadata in zip(files, metadatas):
+        if metadata is None:
+            continue
+        if filename in data:
+            raise ValueError(f"Multiple sources load same ({filename})")
+        data[filename] = _metadata_use(metadata)
 
     results = []
     for source in sorted(data):
@@ -327,20 +641,16 @@ def sources_foreach(args, func):
     return results
 
 
+CmdSpec = collections.namedtuple("CmdSpec", ["name", "func", "help", "arg"])
+
 subc_list = {}
 
 
-def CLI(action, **kwargs):
+def CLI(action, arg=None):
     def wrap(f):
-        entry = {
-            "func": f,
-            "help": f.__doc__,
-        }
-        entry.update(kwargs)
-
         if action in subc_list:
             raise ValueError(f"Duplicate action {action}")
-        subc_list[action] = entry
+        subc_list[action] = CmdSpec(action, f, f.__doc__, arg)
         return f
     return wrap
 
@@ -348,16 +658,16 @@ def CLI(action, **kwargs):
 @CLI("add", arg="pathname")
 def subc_add(args):
     """Add a new file or directory to the list of managed sources"""
-    conffile = "sources.yml"  # FIXME dry
-
-    sources = _config_load(conffile)
+    sources = _config_load(_sources_conf)
     for name in args.pathname:
-        name = os.path.expanduser(name)
+        name = _expanduser(name)
+        try:
+            os.stat(name)
+        except OSError:
+            raise ValueError(f"{name} does not exist") from None
         name = os.path.realpath(name)
-        if not os.path.exists(name):
-            raise ValueError(f"{name} does not exist")
         sources[name] = True
-    _config_save(conffile, sources)
+    _config_save(_sources_conf, sources)
 
 
 @CLI("install", arg="pathname")
@@ -376,7 +686,7 @@ def subc_debug_meta(args):
     def debug_meta(args, filename, metadata):
         """Pretty print the metadata loaded from the file"""
         db = {filename: metadata}
-        print(yaml.safe_dump(db, default_flow_style=False))
+        print(_yaml_dump(db, default_flow_style=False))
 
     sources_foreach(args, debug_meta)
 
@@ -384,16 +694,19 @@ def subc_debug_meta(args):
 @CLI("packages_list", arg="pathname")
 def subc_packages_list(args):
     """Show the list of package names needed"""
-    if distro.id() == 'debian':
+    distro_id = _distro_id()
+    if distro_id == 'debian':
         packages_key = "dpkg"
-    elif distro.id() == 'raspbian':
+    elif distro_id == 'raspbian':
         # Gah, this is much annoyance
         packages_key = "dpkg"
     else:
         raise NotImplementedError("Unknown distro")
 
     def packages(args, filename, metadata):
-        return metadata.get(packages_key, None)
+        if packages_key not in metadata:
+            return None
+        return _as_list(metadata[packages_key])
 
     raw = sources_foreach(args, packages)
     result = set()
@@ -432,16 +745,23 @@ def argparser():
         help="Command",
     )
 
-    for name, data in sorted(subc_list.items()):
-        func = data["func"]
-        arg = False
-        if "arg" in data and data["arg"]:
-            arg = data["arg"]
+    # Only one subcommand is ever run, so when it can be seen on the
+    # command line, dont bother building the parsers for all the others.
+    # (the full set is still needed for the top level --help or errors)
+    wanted = subc_list
+    for word in sys.argv[1:]:
+        if word in ("-h", "--help"):
+            break
+        if not word.startswith("-"):
+            if word in subc_list:
+                wanted = {word: subc_list[word]}
+            break
 
-        cmd = subc.add_parser(name, help=data["help"])
-        cmd.set_defaults(func=func)
-        if arg:
-            cmd.add_argument(arg, nargs="*")
+    for spec in sorted(wanted.values()):
+        cmd = subc.add_parser(spec.name, help=spec.help)
+        cmd.set_defaults(func=spec.func)
+        if spec.arg:
+            cmd.add_argument(spec.arg, nargs="*")
 
     r = args.parse_args()
     return r